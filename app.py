@@ -1,21 +1,54 @@
 from fastapi import FastAPI, HTTPException
-from celery.result import AsyncResult  
+from fastapi.concurrency import run_in_threadpool
+from celery.result import AsyncResult
+import redis.asyncio as redis
+import re
 import uuid
-import json
+import orjson
+from typing import Optional
 from models import PRDetails, CodeAnalysisRequest
-from tasks import analyze_pr_task, analyze_code_task, fetch_pr_details 
-from fastapi.responses import JSONResponse
+from tasks import analyze_pr_task, analyze_code_task, inflight_lock_key, release_inflight_lock
+from fastapi.responses import ORJSONResponse
 import logging
-from celery_config import app as celery_app
+from celery_config import app as celery_app, REDIS_URL
 
 logger = logging.getLogger(__name__)
-app = FastAPI()
+
+# Seconds an in-flight /analyze-code lock may be held before it expires on its own.
+INFLIGHT_LOCK_TTL = 600
+
+# Capped at 50 connections; when all are in use, a request waits up to 5 seconds for one to be released instead of
+# failing with "Too many connections".
+redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=50, timeout=5))
+
+# Extracts the body of a model response that is wholly one ``` / ```json fenced block; backticks inside the JSON
+# (e.g. in a suggestion) do not end it. _FIRST_FENCE is the fallback for a fenced block followed by prose or
+# further code blocks.
+_FENCE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+_FIRST_FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+
+def _parse_analysis(analysis: str):
+    """
+    Parses a model's analysis as JSON, trying the whole-response fence, then the first fenced block, then the raw text.
+
+    Raises orjson.JSONDecodeError if none of them is valid JSON.
+    """
+
+    for fence in (_FENCE.match(analysis), _FIRST_FENCE.search(analysis)):
+        if fence:
+            try:
+                return orjson.loads(fence.group(1))
+            except orjson.JSONDecodeError:
+                pass
+    return orjson.loads(analysis)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.post("/analyze-pr")
-def analyze_pr(pr_details: PRDetails):
+async def analyze_pr(pr_details: PRDetails):
     
     """
-    Initiates asynchronous analysis of a pull request and returns immediate details.
+    Initiates asynchronous analysis of a pull request and returns its task ID immediately.
 
     Input:
         JSON request body containing a PRDetails object.
@@ -23,53 +56,61 @@ def analyze_pr(pr_details: PRDetails):
     Function:
         1. Parses the request body to get the PR details (PRDetails object).
         2. Generates a unique task ID.
-        3. Converts the PR details to a dictionary.
-        4. Starts an asynchronous Celery task `analyze_pr_task` with the task ID and PR details dictionary.
-        5. Fetches the pull request details from GitHub using `fetch_pr_details`.
-        6. Constructs a response dictionary containing the task ID, PR details, and analysis results (which will be filled in later by the asynchronous task).
-        7. Returns a JSON response with the response dictionary.
-        8. Logs any exceptions and returns a JSON error response with status code 500.
+        3. Starts an asynchronous Celery task `analyze_pr_task` under the task ID, off the event loop, with the task ID, repository URL, (owner, repo) pair parsed once
+           by the model, PR number and token.
+           The task fetches the pull request details from GitHub; the handler itself does no GitHub I/O.
+        4. Returns a JSON response with the task ID and status "pending". The PR details are available from `/status/{task_id}`
+           once the task completes.
+        5. Returns a JSON error response with status code 500 if the task cannot be enqueued.
 
 
     Output:
         JSON response with:
             - task_id: Unique identifier for the asynchronous analysis task.
-            - repo: URL of the repository containing the pull request.
-            - pr_number: Pull request number.
-            - title: Title of the pull request (if available).
-            - author: Login name of the pull request author (if available).
-            - status: Current status of the pull request (e.g., "open", "closed").
-            - mergeable: Whether the pull request is mergeable (if available).
+            - status: "pending".
         - Status code 500 with an error message if an exception occurs.
     """
 
 
-    task_id = str(uuid.uuid4()) 
-    
-    pr_details_dict = pr_details.dict()
-    task = analyze_pr_task.apply_async(args=[task_id, pr_details_dict])
-    
     try:
-        pr_data = fetch_pr_details(pr_details.repo_url, pr_details.pr_number, pr_details.github_token)
-        logging.info(pr_data)
-        response_data = {
-            "task_id": task.id,
-            "repo": pr_details.repo_url,
-            "pr_number": pr_details.pr_number,
-            "title": pr_data.get("title"),
-            "author": pr_data.get("user", {}).get("login"),
-            "status": pr_data.get("state"),
-            "mergeable": pr_data.get("mergeable"),
-        }
+        task_id = str(uuid.uuid4()) 
         
-        return JSONResponse(content=response_data)
+        owner, repo = pr_details.owner_repo
+        task = await run_in_threadpool(
+            analyze_pr_task.apply_async,
+            args=[task_id, pr_details.repo_url, owner, repo, pr_details.pr_number, pr_details.github_token],
+            task_id=task_id,
+        )
+
+        return ORJSONResponse(content={"task_id": task.id, "status": "pending"})
     
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        return ORJSONResponse(status_code=500, content={"error": str(e)})
+
+
+def _wait_for_analysis(task_id: str, args: Optional[list] = None, lock_key: Optional[str] = None):
+    """
+    Enqueues `analyze_code_task` under task_id (or, without args, joins the task already running under it) and waits for its result.
+
+    Runs on a single threadpool thread: Celery's result backend is thread-local, so the AsyncResult must be created and
+    drained on the same thread, never on the event loop. The task releases lock_key itself when it finishes; it is only
+    released here if the task could not be enqueued.
+    """
+
+    if args is None:
+        task_result = AsyncResult(task_id, app=celery_app)
+    else:
+        try:
+            task_result = analyze_code_task.apply_async(args=args, task_id=task_id)
+        except Exception:
+            release_inflight_lock(lock_key, task_id)
+            raise
+
+    return task_result.get(timeout=30, interval=0.01)
 
 
 @app.post("/analyze-code")
-def analyze_code(request: CodeAnalysisRequest):
+async def analyze_code(request: CodeAnalysisRequest):
     """
     Initiates asynchronous code analysis and returns the analysis result when complete.
 
@@ -79,12 +120,20 @@ def analyze_code(request: CodeAnalysisRequest):
     Function:
         1. Parses the request body to get the code analysis request (CodeAnalysisRequest object).
         2. Generates a unique task ID.
-        3. Converts the request object to a dictionary.
-        4. Starts an asynchronous Celery task `analyze_code_task` with the task ID and request dictionary.
-        5. Waits for the Celery task result with a timeout of 30 seconds.
+        3. Takes the Redis single-flight lock for (repository, PR number, model, GitHub token hash) with SET NX EX:
+            - If acquired, starts an asynchronous Celery task `analyze_code_task` under that task ID, with the
+              repository URL, (owner, repo) pair, PR number, token and model name.
+            - Otherwise, an identical analysis is already in flight; its task ID is read from the lock and reused
+              instead of enqueuing a duplicate task.
+        4. Enqueues the task (if needed) and waits for its result with a timeout of 30 seconds, both on one threadpool thread
+           so the event loop never blocks on Redis. The Redis result backend delivers the result over pub/sub; `interval`
+           is passed for other backends and has no effect on it.
+        5. The lock is released by `analyze_code_task` when it finishes, not when this wait ends; if the wait times out the
+           lock stays held so later requests keep joining the running task (it expires after INFLIGHT_LOCK_TTL at the latest).
         6. Checks if the task result is a dictionary.
         7. If the result is a dictionary and contains analysis for each file:
-            - Attempts to parse the analysis content for each file as JSON (assuming it's wrapped in code fences).
+            - Attempts to parse the analysis content for each file as JSON, taken from its code fence if it has one.
+              Analyses that are not valid JSON are returned as the raw text.
         8. Constructs a response dictionary with the status ("completed"), task ID, and the raw analysis result.
         9. Returns a JSON response with the response dictionary.
         10. Logs any exceptions and returns a JSON error response with status code 500.
@@ -98,16 +147,33 @@ def analyze_code(request: CodeAnalysisRequest):
         - Status code 500 with an error message if an exception occurs.
     """
 
+    task_id = str(uuid.uuid4())
+
     try:
-        task_id = str(uuid.uuid4())
-        task_result = analyze_code_task.apply_async(args=[task_id, request.dict()])
-        raw_result = task_result.get(timeout=30)
+        owner, repo = request.owner_repo
+        lock_key = inflight_lock_key(owner, repo, request.pr_number, request.model_name, request.github_token)
+        acquired = await redis_client.set(lock_key, task_id, nx=True, ex=INFLIGHT_LOCK_TTL)
+        inflight_task_id = None if acquired else await redis_client.get(lock_key)
+
+        if inflight_task_id:
+            task_id = inflight_task_id.decode()
+            raw_result = await run_in_threadpool(_wait_for_analysis, task_id)
+        else:
+            raw_result = await run_in_threadpool(
+                _wait_for_analysis,
+                task_id,
+                [task_id, request.repo_url, owner, repo, request.pr_number, request.github_token, request.model_name],
+                lock_key,
+            )
         
         if isinstance(raw_result, dict):
-            for file_analysis in raw_result.get("result", {}).get("analysis", []):
+            for file_analysis in raw_result.get("analysis", []):
                 
                 if "analysis" in file_analysis and isinstance(file_analysis["analysis"], str):
-                    file_analysis["analysis"] = json.loads(file_analysis["analysis"].strip("```json\n").strip("```"))
+                    try:
+                        file_analysis["analysis"] = _parse_analysis(file_analysis["analysis"])
+                    except orjson.JSONDecodeError:
+                        logger.warning("Analysis for %s is not valid JSON", file_analysis.get("name"))
         
         response_data = {
             "status": "completed",
@@ -115,15 +181,41 @@ def analyze_code(request: CodeAnalysisRequest):
             "result": raw_result
         }
         
-        return JSONResponse(content=response_data)
+        return ORJSONResponse(content=response_data)
     except Exception as e:
-        logging.error(f"Error processing task: {str(e)}")
-        return JSONResponse(
+        logger.error("Error processing task %s: %s", task_id, e)
+        return ORJSONResponse(
             content={"task_id": task_id, "error": str(e)},
             status_code=500
         )
 
 
+def _fetch_task_metas(task_ids: list) -> list:
+    """Reads the stored Celery result metadata of several tasks in one Redis MGET (None where nothing is stored yet)."""
+
+    backend = celery_app.backend
+    payloads = backend.client.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    return [backend.decode_result(payload) if payload else None for payload in payloads]
+
+
+def _status_response(task_id: str, meta: Optional[dict]) -> dict:
+    """Maps a task's result metadata to the status response returned by the /status endpoints."""
+
+    state = meta["status"] if meta else "PENDING"
+    logger.debug("Task %s state: %s", task_id, state)
+
+    if state == "PENDING":
+        return {"task_id": task_id, "status": "pending"}
+    elif state == "STARTED":
+        return {"task_id": task_id, "status": "processing"}
+    elif state == "SUCCESS":
+        return {"task_id": task_id, "status": "completed", "result": meta["result"]}
+    elif state == "FAILURE":
+        return {"task_id": task_id, "status": "failed", "error": str(meta["result"])}
+    else:
+        return {"task_id": task_id, "status": "unknown"}
+
+
 @app.get("/status/{task_id}")
 def get_status(task_id: str):
     """
@@ -133,10 +225,10 @@ def get_status(task_id: str):
         task_id: Unique identifier for the task (string).
 
     Function:
-        1. Creates a Celery AsyncResult object using the provided task ID.
-        2. Logs the task state for informational purposes.
+        1. Reads the task's result metadata from the Celery Redis backend in a single round-trip.
+        2. Logs the task state at DEBUG level.
         3. Checks the task state:
-            - If "PENDING": return status "pending".
+            - If "PENDING" (or no metadata stored yet): return status "pending".
             - If "STARTED": return status "processing".
             - If "SUCCESS": return status "completed" with the task result.
             - If "FAILURE": return status "failed" with the error message.
@@ -151,16 +243,29 @@ def get_status(task_id: str):
             - error (optional): Error message if the status is "failed".
     """
 
-    task = AsyncResult(task_id, app=celery_app)  
-    logger.info(f"Task {task_id} state: {task.state}")  
-    
-    if task.state == "PENDING":
-        return {"task_id": task.id, "status": "pending"}
-    elif task.state == "STARTED":
-        return {"task_id": task.id, "status": "processing"}
-    elif task.state == "SUCCESS":
-        return {"task_id": task.id, "status": "completed", "result": task.result}
-    elif task.state == "FAILURE":
-        return {"task_id": task.id, "status": "failed", "error": str(task.info)} 
-    else:
-        return {"task_id": task.id, "status": "unknown"}
+    return _status_response(task_id, _fetch_task_metas([task_id])[0])
+
+
+@app.get("/status")
+def get_statuses(ids: str):
+    """
+    Retrieves the status of several asynchronous tasks at once.
+
+    Input:
+        ids: Comma-separated task IDs (query parameter, e.g. "/status?ids=a,b,c").
+
+    Function:
+        1. Splits the ids parameter into task IDs. Returns status code 400 if there are none.
+        2. Reads the result metadata of all tasks from the Celery Redis backend with a single MGET.
+        3. Maps each task's state to a status response, as in `/status/{task_id}`.
+
+    Output:
+        JSON list with one status response per task ID, in the requested order.
+    """
+
+    task_ids = [task_id for task_id in ids.split(",") if task_id]
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="No task IDs given.")
+
+    metas = _fetch_task_metas(task_ids)
+    return [_status_response(task_id, meta) for task_id, meta in zip(task_ids, metas)]
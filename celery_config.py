@@ -5,6 +5,7 @@ Input:
 - 'tasks': The name of the Celery app and the module containing task definitions.
 - Redis broker URL: 'redis://localhost:6379/0' (Default Redis instance).
 - Redis backend URL: 'redis://localhost:6379/0' (Default Redis instance).
+- REDIS_URL: The Redis URL above, shared with the GitHub response cache in tasks.py.
 
 Function:
 1. Creates a Celery app instance named 'tasks', using Redis as both the message broker and result backend.
@@ -13,7 +14,14 @@ Function:
     a. result_expires: Sets the expiration time for task results to 3600 seconds (1 hour). After this time, results are deleted from the backend.
     b. task_default_retry_delay: Sets the default delay before retrying a failed task to 30 seconds.
     c. task_max_retries: Sets the maximum number of retry attempts for a task to 5.
-    d. task_acks_late: Configures tasks to be acknowledged *after* execution, ensuring that tasks are not lost if a worker crashes during processing.
+    d. task_acks_late: Disabled, so tasks are acknowledged as soon as a worker receives them. Late acks on the Redis broker delay
+       delivery of queued tasks by up to a few seconds. Both tasks are safe to re-run: analyze_pr_task retries itself via self.retry,
+       while analyze_code_task does not retry and reports a failure to the waiting request. The tradeoff is that a task
+       running on a worker that crashes is lost and must be resubmitted by the client.
+    e. worker_pool / worker_concurrency: Runs tasks on a pool of 16 threads instead of one process per task. Both tasks are I/O-bound
+       (GitHub and Groq over asyncio), so threads give more tasks in flight per worker with far less memory than prefork.
+    f. task_serializer / result_serializer / accept_content: Encodes task arguments and results with msgpack, which is smaller on
+       the wire and faster to parse than JSON for the PR file listings and analysis results.
 
 Output:
 - app: A fully configured Celery application instance, ready for defining and executing tasks.
@@ -22,7 +30,9 @@ Output:
 
 from celery import Celery
 
-app = Celery('tasks', broker='redis://localhost:6379/0', backend='redis://localhost:6379/0')
+REDIS_URL = 'redis://localhost:6379/0'
+
+app = Celery('tasks', broker=REDIS_URL, backend=REDIS_URL)
 
 app.autodiscover_tasks(['tasks']) 
 
@@ -30,6 +40,11 @@ app.conf.update(
     result_expires=3600,
     task_default_retry_delay=30,
     task_max_retries=5,
-    task_acks_late=True,
+    task_acks_late=False,
+    worker_pool='threads',
+    worker_concurrency=16,
+    task_serializer='msgpack',
+    result_serializer='msgpack',
+    accept_content=['msgpack'],
 )
 
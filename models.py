@@ -1,13 +1,35 @@
-from pydantic import BaseModel
-from typing import Optional
+from functools import cached_property
+from pydantic import BaseModel, computed_field, field_validator
+from typing import Optional, Tuple
+from urllib.parse import urlparse
 
-class PRDetails(BaseModel):
+def _path_segments(repo_url: str) -> list:
+    """The non-empty path segments of repo_url."""
+    return [segment for segment in urlparse(repo_url.strip()).path.split("/") if segment]
+
+class RepoRequest(BaseModel):
     repo_url: str
+
+    @field_validator("repo_url")
+    @classmethod
+    def check_repo_url(cls, repo_url: str) -> str:
+        """Rejects repo URLs without an owner and a repo path segment, so owner_repo always parses."""
+        if len(_path_segments(repo_url)) < 2:
+            raise ValueError("repo_url must be of the form https://github.com/<owner>/<repo>")
+        return repo_url
+
+    @computed_field
+    @cached_property
+    def owner_repo(self) -> Tuple[str, str]:
+        """The (owner, repo) pair of repo_url, parsed once per request."""
+        segments = _path_segments(self.repo_url)
+        return segments[-2], segments[-1]
+
+class PRDetails(RepoRequest):
     pr_number: int
     github_token: Optional[str] = None
 
-class CodeAnalysisRequest(BaseModel):
-    repo_url: str
+class CodeAnalysisRequest(RepoRequest):
     pr_number: int
     github_token: Optional[str] = None
     groq_lpu: str  
@@ -1,54 +1,192 @@
-from celery_config import app  # Import Celery app configuration
-import requests
-from models import PRDetails
-from groq import Groq
+from celery_config import app, REDIS_URL  # Import Celery app configuration
+import asyncio
+import hashlib
+import httpx
+import orjson
+import redis
+import redis.asyncio
+import threading
+from groq import AsyncGroq
 from typing import Optional
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel
-from models import CodeAnalysisRequest
 import logging
 
-groq_client = Groq(api_key="Please add your GROQ Api key here")
+logger = logging.getLogger(__name__)
 
-def fetch_pr_details(repo_url: str, pr_number: int, token: Optional[str] = None):
+GROQ_API_KEY = "Please add your GROQ Api key here"
+
+# Upper bound on files analyzed at once per task, to stay under Groq rate limits.
+GROQ_CONCURRENCY = 8
+
+# Seconds to keep cached GitHub responses. PR metadata is always revalidated with a conditional
+# request, so it is kept long enough for repeated polls to be answered with a body-less 304. Raw file
+# URLs are pinned to a commit SHA, so their content never changes and is served straight from the cache;
+# its TTL only bounds how long Redis holds content of PRs that are no longer being analyzed.
+PR_METADATA_TTL = 86400
+RAW_CONTENT_TTL = 7 * 86400
+
+# Groq analyses are cached by (prompt version, model, file content). Bump PROMPT_VERSION whenever the
+# prompt template changes so stale analyses are not served.
+PROMPT_VERSION = "v1"
+ANALYSIS_CACHE_TTL = 86400
+
+# Files smaller than SMALL_FILE_BYTES share one Groq request, with up to BATCH_MAX_BYTES of source per request.
+SMALL_FILE_BYTES = 4096
+BATCH_MAX_BYTES = 16384
+
+# One Redis connection pool (parsed with hiredis when installed) shared by every task in the worker.
+redis_client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(REDIS_URL, max_connections=50))
+
+# Each worker thread keeps its own event loop, HTTP client, Groq client and async Redis client, created on
+# first use and reused by every task that thread runs, so connections stay open between tasks.
+_worker_local = threading.local()
+
+# Deletes a single-flight lock only while it still holds the given task ID, so a finished task never
+# releases a lock that has since expired and been taken by a newer task.
+_release_lock_script = redis_client.register_script(
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+)
+
+def new_http_client() -> httpx.AsyncClient:
+    """
+    Creates the async HTTP client used for GitHub calls.
+
+    Output:
+    - An httpx.AsyncClient with a pooled, keep-alive connection limit. HTTP/2 is negotiated where the
+      server supports it, so concurrent GitHub calls are multiplexed over one connection per host.
+      Redirects are followed so that GitHub "raw_url" links resolve to raw.githubusercontent.com.
+    """
+
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        headers={"Accept": "application/vnd.github+json"},
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        follow_redirects=True,
+    )
+
+def _run(coro):
+    """Runs a coroutine to completion on this worker thread's event loop."""
+
+    loop = getattr(_worker_local, "loop", None)
+    if loop is None:
+        loop = _worker_local.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
+
+def _http_client() -> httpx.AsyncClient:
+    """Returns this worker thread's GitHub HTTP client, creating it on first use."""
+
+    client = getattr(_worker_local, "http_client", None)
+    if client is None:
+        client = _worker_local.http_client = new_http_client()
+    return client
+
+def _groq_client() -> AsyncGroq:
+    """Returns this worker thread's Groq client, creating it on first use."""
+
+    groq_client = getattr(_worker_local, "groq_client", None)
+    if groq_client is None:
+        groq_client = _worker_local.groq_client = AsyncGroq(api_key=GROQ_API_KEY)
+    return groq_client
+
+def _async_redis_client() -> redis.asyncio.Redis:
+    """Returns this worker thread's async Redis client, used by coroutines that must not block the event loop."""
+
+    async_redis_client = getattr(_worker_local, "async_redis_client", None)
+    if async_redis_client is None:
+        async_redis_client = _worker_local.async_redis_client = redis.asyncio.Redis.from_url(REDIS_URL)
+    return async_redis_client
+
+async def _cached_get(client: httpx.AsyncClient, url: str, headers: dict, ttl: int, immutable: bool = False):
+    """
+    Sends a GET request to GitHub through the Redis response cache.
+
+    Input:
+    - client: The shared httpx.AsyncClient used for the request.
+    - url: The URL to fetch.
+    - headers: Request headers (including "Authorization" if a token is used).
+    - ttl: Seconds to keep the cached response in Redis.
+    - immutable (Optional): If True, a cached body is returned without contacting GitHub at all.
+
+    Function:
+    1. Looks up the cached {etag, last_modified, body} entry keyed by the SHA-1 of the URL and Authorization header.
+    2. For immutable URLs, returns the cached body if there is one.
+    3. Otherwise sends the cached validators as "If-None-Match" / "If-Modified-Since". On 304 (Not Modified), which
+       transfers no body and does not count against GitHub's primary rate limit, refreshes the TTL and returns the cached body.
+    4. On 200, overwrites the cache entry with the new validators and body.
+
+    Output:
+    - A (status_code, body) tuple. A 304 answered from the cache is reported as 200.
+    """
+
+    cache = _async_redis_client()
+    key = "github:" + hashlib.sha1(f"{url}|{headers.get('Authorization', '')}".encode()).hexdigest()
+    cached = await cache.get(key)
+    entry = orjson.loads(cached) if cached else None
+
+    if entry and immutable:
+        return 200, entry["body"]
+
+    if entry:
+        headers = dict(headers)
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = await client.get(url, headers=headers)
+    if response.status_code == 304 and entry:
+        await cache.expire(key, ttl)
+        return 200, entry["body"]
+
+    if response.status_code == 200:
+        await cache.setex(key, ttl, orjson.dumps({
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body": response.text,
+        }))
+
+    return response.status_code, response.text
+
+async def fetch_pr_details(client: httpx.AsyncClient, owner: str, repo: str, pr_number: int, token: Optional[str] = None):
     
     """
     Fetches details of a pull request from GitHub.
 
     Input:
-    - repo_url: The URL of the GitHub repository (e.g., "https://github.com/owner/repo").
+    - client: The shared httpx.AsyncClient used for the request.
+    - owner: The owner of the GitHub repository.
+    - repo: The name of the GitHub repository.
     - pr_number: The pull request number (an integer).
     - token (Optional): A GitHub personal access token for authentication (a string).
 
     Function:
-    1. Extracts the owner and repository name from the repo_url.
-    2. Constructs the GitHub API URL for the pull request.
-    3. Creates a headers dictionary for the request. If a token is provided, adds an "Authorization" header.
-    4. Sends a GET request to the GitHub API.
-    5. Checks the response status code. If it's not 200 (OK), raises an exception with the status code and error message.
-    6. Parses the JSON response and returns it.
+    1. Constructs the GitHub API URL for the pull request.
+    2. Creates a headers dictionary for the request. If a token is provided, adds an "Authorization" header.
+    3. Awaits a GET request to the GitHub API, revalidating a cached response by its ETag.
+    4. Checks the response status code. If it's not 200 (OK), raises an exception with the status code and error message.
+    5. Parses the JSON response and returns it.
 
     Output:
     - A dictionary containing the pull request details (JSON response from the GitHub API).
     - Raises an exception if the request fails (status code other than 200).
     """
 
-    parts = repo_url.rstrip("/").split("/")
-    owner, repo = parts[-2], parts[-1]
     pr_api_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}"
 
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
 
-    response = requests.get(pr_api_url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch PR details: {response.status_code} {response.text}")
+    status_code, body = await _cached_get(client, pr_api_url, headers, PR_METADATA_TTL)
+    if status_code != 200:
+        raise Exception(f"Failed to fetch PR details: {status_code} {body}")
 
-    return response.json()
+    return orjson.loads(body)
 
 @app.task(bind=True, max_retries=3)
-def analyze_pr_task(self,task_id: str, pr_details_dict: dict):
+def analyze_pr_task(self, task_id: str, repo_url: str, owner: str, repo: str, pr_number: int, token: Optional[str] = None):
     
     """
     Analyzes a pull request and extracts relevant information.
@@ -56,16 +194,17 @@ def analyze_pr_task(self,task_id: str, pr_details_dict: dict):
     Input:
     - self: The Celery task instance (used for retrying).
     - task_id: A unique identifier for the task (string).
-    - pr_details_dict: A dictionary containing pull request details necessary for fetching information (Dict[str, Any]). It is expected to have keys corresponding to the attributes of PRDetails class.
+    - repo_url: The URL of the GitHub repository (e.g., "https://github.com/owner/repo").
+    - owner, repo: The owner and name of the repository, already parsed from repo_url.
+    - pr_number: The pull request number (an integer).
+    - token (Optional): A GitHub personal access token for authentication (a string).
 
     Function:
-    1. Prints the task arguments for debugging.
-    2. Creates a PRDetails object from the input dictionary.
-    3. Fetches detailed PR data from GitHub using the provided details via fetch_pr_details function.
-    4. Extracts relevant information from the fetched PR data (title, author, status, mergeable status).
-    5. Constructs a result dictionary containing the extracted information.
-    6. Prints the result dictionary for debugging.
-    7. Returns a dictionary with the result.
+    1. Fetches detailed PR data from GitHub via fetch_pr_details function, run on the worker thread's event loop.
+    2. Extracts relevant information from the fetched PR data (title, author, status, mergeable status).
+    3. Constructs a result dictionary containing the extracted information.
+    4. Logs the result dictionary at DEBUG level.
+    5. Returns a dictionary with the result.
 
     Output:
     - A dictionary containing the analysis result
@@ -75,52 +214,63 @@ def analyze_pr_task(self,task_id: str, pr_details_dict: dict):
 
 
     try:
-        print(f"Task arguments: {task_id}, {pr_details_dict}")
-        pr_details = PRDetails(**pr_details_dict)
-        pr_data = fetch_pr_details(pr_details.repo_url, pr_details.pr_number, pr_details.github_token)
+        pr_data = _run(fetch_pr_details(_http_client(), owner, repo, pr_number, token))
 
         result = {
-            "repo": pr_details.repo_url,
-            "pr_number": pr_details.pr_number,
+            "repo": repo_url,
+            "pr_number": pr_number,
             "title": pr_data.get("title"),
             "author": pr_data.get("user", {}).get("login"),
             "status": pr_data.get("state"),
             "mergeable": pr_data.get("mergeable"),
         }
 
-        print(result)
+        logger.debug("Task %s result: %s", task_id, result)
         return {"result": result}
 
     except Exception as e:
         raise self.retry(exc=e)  
 
-def fetch_pr_files(repo_url: str, pr_number: int, token: Optional[str] = None):
-    parts = repo_url.rstrip("/").split("/")
-    owner, repo = parts[-2], parts[-1]
+async def fetch_pr_files(client: httpx.AsyncClient, owner: str, repo: str, pr_number: int, token: Optional[str] = None):
+    """Fetches the files changed by a pull request from GitHub.
+
+    Input:
+        client: The shared httpx.AsyncClient used for the request.
+        owner: Repository owner.
+        repo: Repository name.
+        pr_number: Pull request number.
+        token (Optional): GitHub personal access token.
+
+    Returns:
+        A (file_names, raw_urls) tuple of parallel lists. Only these two fields are kept from the GitHub
+        response; the rest of each file entry is dropped right after parsing.
+        Raises an exception on API errors (non-200 status).
+    """
+
     files_api_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}/files"
 
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
 
-    response = requests.get(files_api_url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch PR files: {response.status_code} {response.text}")
+    status_code, body = await _cached_get(client, files_api_url, headers, PR_METADATA_TTL)
+    if status_code != 200:
+        raise Exception(f"Failed to fetch PR files: {status_code} {body}")
 
-    print(f"fetch pr files : {response.text}")
-    return response.json()
+    files = orjson.loads(body)
+    return [file["filename"] for file in files], [file["raw_url"] for file in files]
 
-def fetch_file_content(raw_url: str, token: Optional[str] = None):
+async def fetch_file_content(client: httpx.AsyncClient, raw_url: str, token: Optional[str] = None):
     
-    """Fetches PR files from GitHub.
+    """Fetches the raw content of one PR file from GitHub.
 
     Input:
-        repo_url: Repository URL (e.g., "https://github.com/owner/repo").
-        pr_number: Pull request number.
+        client: The shared httpx.AsyncClient used for the request.
+        raw_url: The file's raw_url, as returned by fetch_pr_files.
         token (Optional): GitHub personal access token.
 
     Returns:
-        A list of dictionaries representing PR files.
+        The file content as text, served from the Redis cache when it was fetched before.
         Raises an exception on API errors (non-200 status).
     """
 
@@ -129,34 +279,255 @@ def fetch_file_content(raw_url: str, token: Optional[str] = None):
     if token:
         headers["Authorization"] = f"Bearer {token}"
 
-    response = requests.get(raw_url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to fetch file content: {response.status_code} {response.text}")
+    status_code, body = await _cached_get(client, raw_url, headers, RAW_CONTENT_TTL, immutable=True)
+    if status_code != 200:
+        raise Exception(f"Failed to fetch file content: {status_code} {body}")
+
+    return body
+
+
+def inflight_lock_key(owner: str, repo: str, pr_number: int, model_name: str, token: Optional[str]) -> str:
+    """
+    Returns the Redis key of the single-flight lock for one PR analysis.
+
+    A hash of the GitHub token is part of the key, so a request only joins an in-flight analysis that was
+    run with the same credentials and never receives private source it could not fetch itself.
+    """
+
+    token_digest = hashlib.sha256((token or "").encode()).hexdigest()
+    return f"inflight:{owner}/{repo}:{pr_number}:{model_name}:{token_digest}"
+
+
+def release_inflight_lock(lock_key: str, task_id: str):
+    """Releases the single-flight lock at lock_key if it is still held by task_id."""
+
+    _release_lock_script(keys=[lock_key], args=[task_id])
+
+
+def _analysis_cache_key(model_name: str, content: str) -> str:
+    digest = hashlib.sha256(f"{PROMPT_VERSION}|{model_name}|{content}".encode()).hexdigest()
+    return f"groq:{digest}"
+
+
+# Constant parts of the Groq prompts, built once at import. The headers are str.format templates that
+# are filled in with the model name once per task, not once per file.
+FILE_PROMPT_HEADER = (
+    "You are a code analysis AI agent powered by the Groq platform.\n"
+    "Your task is to analyze the provided code snippet using the model: {model_name}.\n\n"
+    "### Instructions:\n"
+    "Analyze the code for the following:\n"
+    "1. **Code style and formatting issues** (e.g., indentation, naming conventions)\n"
+    "2. **Potential bugs or errors** (e.g., null pointer exceptions, incorrect logic)\n"
+    "3. **Performance improvements** (e.g., optimize loops, reduce memory usage)\n"
+    "4. **Best practices** (e.g., modularization, documentation, coding standards)\n"
+).format
+
+FILE_PROMPT_FOOTER = (
+    "\n### Expected Output:\n"
+    "You will provide the analysis in JSON format. The JSON should include:\n"
+    "- A list of **issues** for each file, specifying:\n"
+    "  - Type of issue (e.g., 'style', 'bug', 'performance')\n"
+    "  - Line number\n"
+    "  - Description of the issue\n"
+    "  - Suggestions for improvement\n"
+    "- A **summary** with:\n"
+    "  - Total files analyzed\n"
+    "  - Total issues found\n"
+    "  - Critical issues count (if applicable)\n\n"
+)
+
+BATCH_PROMPT_HEADER = (
+    "You are a code analysis AI agent powered by the Groq platform.\n"
+    "Your task is to analyze each of the provided files using the model: {model_name}.\n\n"
+    "### Instructions:\n"
+    "Analyze the code of every file for the following:\n"
+    "1. **Code style and formatting issues** (e.g., indentation, naming conventions)\n"
+    "2. **Potential bugs or errors** (e.g., null pointer exceptions, incorrect logic)\n"
+    "3. **Performance improvements** (e.g., optimize loops, reduce memory usage)\n"
+    "4. **Best practices** (e.g., modularization, documentation, coding standards)\n"
+).format
+
+BATCH_PROMPT_FOOTER = (
+    "\n### Expected Output:\n"
+    "You will provide a single JSON object whose keys are the file names above, exactly as given.\n"
+    "The value for each file is its analysis, which should include:\n"
+    "- A list of **issues**, specifying:\n"
+    "  - Type of issue (e.g., 'style', 'bug', 'performance')\n"
+    "  - Line number\n"
+    "  - Description of the issue\n"
+    "  - Suggestions for improvement\n"
+    "- A **summary** with:\n"
+    "  - Total issues found\n"
+    "  - Critical issues count (if applicable)\n\n"
+)
+
+
+def _file_prompt(header: str, content: str) -> str:
+    """Builds the Groq prompt for analyzing a single file from a pre-formatted FILE_PROMPT_HEADER."""
+
+    return "".join([header, "\n### Input Code:\n```\n", content, "\n```\n", FILE_PROMPT_FOOTER])
+
+
+def _batch_prompt(header: str, files: list) -> str:
+    """Builds one Groq prompt for analyzing several (file_name, content) pairs, answered as a JSON object keyed by file name."""
+
+    parts = [header]
+    for file_name, content in files:
+        parts += ["\n### File: ", file_name, "\n```\n", content, "\n```\n"]
+    parts.append(BATCH_PROMPT_FOOTER)
+    return "".join(parts)
+
+
+def _batch_small_files(files: list) -> list:
+    """Groups (file_name, content) pairs into batches of at most BATCH_MAX_BYTES of source each."""
+
+    batches, batch, batch_bytes = [], [], 0
+    for file_name, content in files:
+        size = len(content.encode())
+        if batch and batch_bytes + size > BATCH_MAX_BYTES:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append((file_name, content))
+        batch_bytes += size
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _complete(groq_client: AsyncGroq, model_name: str, prompt: str, json_mode: bool = False) -> str:
+    """
+    Sends a prompt to Groq and returns the content of the first choice.
+
+    Plain prompts are streamed and the tokens are collected as they arrive. JSON-mode prompts are sent
+    without streaming, since Groq does not stream JSON mode responses.
+    """
 
-    print(f"file content: {response.text}")
-    return response.text
+    messages = [{"role": "system", "content": prompt}]
+
+    if json_mode:
+        chat_completion = await groq_client.chat.completions.create(
+            messages=messages,
+            model=model_name,
+            response_format={"type": "json_object"}
+        )
+
+        if hasattr(chat_completion, 'choices') and isinstance(chat_completion.choices, list):
+            return chat_completion.choices[0].message.content
+        else:
+            raise Exception("Unexpected format from Groq client response.")
+
+    stream = await groq_client.chat.completions.create(messages=messages, model=model_name, stream=True)
+    parts = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+
+    if not parts:
+        raise Exception("Empty response from Groq client.")
+    return "".join(parts)
+
+
+async def _analyze_pr_files(owner: str, repo: str, pr_number: int, token: Optional[str], model_name: str):
+    """
+    Fetches the PR files and analyzes them concurrently with the Groq model.
+
+    File contents are fetched concurrently. Analyses memoized in Redis by file content are reused (looked
+    up with one MGET and stored with one pipeline), so unchanged files skip the Groq call. The remaining files smaller than SMALL_FILE_BYTES are packed into
+    shared multi-file requests; larger files get a request of their own. At most GROQ_CONCURRENCY fetches
+    or Groq requests run at a time. A failure is reported as the affected files' "error" instead of failing
+    the whole PR.
+    """
+
+    client = _http_client()
+    groq_client = _groq_client()
+    file_names, raw_urls = await fetch_pr_files(client, owner, repo, pr_number, token)
+    semaphore = asyncio.Semaphore(GROQ_CONCURRENCY)
+
+    async def fetch_one(raw_url: str):
+        async with semaphore:
+            return await fetch_file_content(client, raw_url, token)
+
+    contents = await asyncio.gather(*[fetch_one(raw_url) for raw_url in raw_urls], return_exceptions=True)
+
+    results = {}
+    pending = []
+    fetched = [(file_name, content) for file_name, content in zip(file_names, contents) if not isinstance(content, Exception)]
+    cached_analyses = redis_client.mget([_analysis_cache_key(model_name, content) for _, content in fetched]) if fetched else []
+    cached_by_file = {file_name: cached for (file_name, _), cached in zip(fetched, cached_analyses)}
+    for file_name, content in zip(file_names, contents):
+        if isinstance(content, Exception):
+            results[file_name] = {"name": file_name, "error": str(content)}
+            continue
+
+        cached_analysis = cached_by_file[file_name]
+        if cached_analysis is not None:
+            results[file_name] = {"name": file_name, "analysis": cached_analysis.decode()}
+        else:
+            pending.append((file_name, content))
+
+    file_header = FILE_PROMPT_HEADER(model_name=model_name)
+    batch_header = BATCH_PROMPT_HEADER(model_name=model_name)
+
+    units = [[file] for file in pending if len(file[1].encode()) >= SMALL_FILE_BYTES]
+    units += _batch_small_files([file for file in pending if len(file[1].encode()) < SMALL_FILE_BYTES])
+
+    async def analyze_unit(unit: list):
+        async with semaphore:
+            if len(unit) == 1:
+                file_name, content = unit[0]
+                analyses = {file_name: await _complete(groq_client, model_name, _file_prompt(file_header, content))}
+            else:
+                batch_content = await _complete(groq_client, model_name, _batch_prompt(batch_header, unit), json_mode=True)
+                batch_analysis = orjson.loads(batch_content)
+                analyses = {
+                    file_name: orjson.dumps(batch_analysis[file_name]).decode()
+                    for file_name, _ in unit if file_name in batch_analysis
+                }
+        return analyses
+
+    unit_results = await asyncio.gather(*[analyze_unit(unit) for unit in units], return_exceptions=True)
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for unit, analyses in zip(units, unit_results):
+        for file_name, content in unit:
+            if isinstance(analyses, Exception):
+                results[file_name] = {"name": file_name, "error": str(analyses)}
+            elif file_name in analyses:
+                results[file_name] = {"name": file_name, "analysis": analyses[file_name]}
+                pipeline.setex(_analysis_cache_key(model_name, content), ANALYSIS_CACHE_TTL, analyses[file_name])
+            else:
+                results[file_name] = {"name": file_name, "error": "File missing from batched Groq response."}
+    pipeline.execute()
+
+    return [results[file_name] for file_name in file_names]
 
 
 @app.task(bind=True, max_retries=3)
-def analyze_code_task(self,task_id: str, request_data: dict):
+def analyze_code_task(self, task_id: str, repo_url: str, owner: str, repo: str, pr_number: int, token: Optional[str], model_name: str):
     """Analyzes code from a pull request using a Groq model.
 
     Input:
         task_id: Unique identifier for the task (string).
-        request_data: Dictionary containing request details (Dict[str, Any]). It's expected to have keys corresponding to the attributes of CodeAnalysisRequest class.
+        repo_url: Repository URL (e.g., "https://github.com/owner/repo").
+        owner, repo: Owner and name of the repository, already parsed from repo_url.
+        pr_number: Pull request number.
+        token (Optional): GitHub personal access token.
+        model_name: Name of the Groq model used for the analysis.
 
     Function:
-        1. Creates a CodeAnalysisRequest object from the input data.
-        2. Fetches the list of files associated with the pull request.
-        3. Iterates over each file:
-            - Fetches the file content.
-            - Constructs a formatted prompt for the Groq model, including instructions and expected output format.
-            - Calls the Groq client to get code analysis using the prompt and specified model.
-            - Extracts the analysis content from the Groq response.
-            - Creates a dictionary containing the filename and analysis result (or error message).
-            - Appends the file analysis result to the overall results list.
-        4. Returns a dictionary with the repository URL, pull request number, and the list of file analysis results.
-        5. Logs and raises an exception if any error occurs during processing.
+        1. Fetches the list of files associated with the pull request (on the worker thread's event loop).
+        2. Analyzes the files concurrently (at most GROQ_CONCURRENCY requests at a time):
+            - Fetches the content of every file.
+            - Reuses the cached analysis of files whose content was already analyzed with this model.
+            - Packs the remaining small files (under SMALL_FILE_BYTES) into multi-file prompts of at most BATCH_MAX_BYTES,
+              and builds a single-file prompt for each larger file.
+            - Calls the Groq client with each prompt and the specified model; multi-file prompts are answered as a JSON object keyed by file name.
+            - Creates a dictionary containing the filename and analysis result (or error message) for each file.
+            - Collects the file analysis results in the original file order.
+        3. Returns a dictionary with the repository URL, pull request number, and the list of file analysis results.
+        4. Logs and raises an exception if any error occurs during processing.
+        5. Releases the /analyze-code single-flight lock held by this task, whether it succeeded or failed.
 
 
     Output:
@@ -165,75 +536,17 @@ def analyze_code_task(self,task_id: str, request_data: dict):
     """
 
     try:
-        request = CodeAnalysisRequest(**request_data)
-        pr_files = fetch_pr_files(request.repo_url, request.pr_number, request.github_token)
-        analysis_results = []
-
-        for file in pr_files:
-            file_name = file["filename"]
-            raw_url = file["raw_url"]
-
-            try:
-                content = fetch_file_content(raw_url, request.github_token)
-
-                header = (
-                    f"You are a code analysis AI agent powered by the Groq platform.\n"
-                    f"Your task is to analyze the provided code snippet using the model: {request.model_name}.\n\n"
-                    "### Instructions:\n"
-                    "Analyze the code for the following:\n"
-                    "1. **Code style and formatting issues** (e.g., indentation, naming conventions)\n"
-                    "2. **Potential bugs or errors** (e.g., null pointer exceptions, incorrect logic)\n"
-                    "3. **Performance improvements** (e.g., optimize loops, reduce memory usage)\n"
-                    "4. **Best practices** (e.g., modularization, documentation, coding standards)\n"
-                )
-
-                input_code = (
-                    "\n### Input Code:\n"
-                    "```\n"
-                    f"{content}\n"
-                    "```\n"
-                )
-
-                output_format = (
-                    "\n### Expected Output:\n"
-                    "You will provide the analysis in JSON format. The JSON should include:\n"
-                    "- A list of **issues** for each file, specifying:\n"
-                    "  - Type of issue (e.g., 'style', 'bug', 'performance')\n"
-                    "  - Line number\n"
-                    "  - Description of the issue\n"
-                    "  - Suggestions for improvement\n"
-                    "- A **summary** with:\n"
-                    "  - Total files analyzed\n"
-                    "  - Total issues found\n"
-                    "  - Critical issues count (if applicable)\n\n"
-                )
-
-                full_prompt = header + input_code + output_format
-
-                chat_completion = groq_client.chat.completions.create(
-                    messages=[{"role": "system", "content": full_prompt}],
-                    model=request.model_name
-                )
-
-                if hasattr(chat_completion, 'choices') and isinstance(chat_completion.choices, list):
-                    analysis_content = chat_completion.choices[0].message.content
-                else:
-                    raise Exception("Unexpected format from Groq client response.")
-
-                analysis = {
-                    "name": file_name,
-                    "analysis": analysis_content
-                }
-                analysis_results.append(analysis)
-            except Exception as e:
-                analysis_results.append({"name": file_name, "error": str(e)})
-        
+        analysis_results = _run(_analyze_pr_files(owner, repo, pr_number, token, model_name))
+
         return {
-            "repo_url": request.repo_url,
-            "pr_number": request.pr_number,
+            "repo_url": repo_url,
+            "pr_number": pr_number,
             "analysis": analysis_results,
         }
 
     except Exception as e:
-        logging.error(f"Error processing task {task_id}: {str(e)}")
+        logger.error("Error processing task %s: %s", task_id, e)
         raise Exception(f"Task failed: {str(e)}")
+
+    finally:
+        release_inflight_lock(inflight_lock_key(owner, repo, pr_number, model_name, token), task_id)